@@ -1,19 +1,101 @@
 #!/usr/bin/python3
 """Script to set the wallpaper according to the day of the week."""
 
+import argparse
 import os
-import datetime
+import json
 import random
+import shutil
+import signal
 import subprocess
+import sys
+import time
+import types
+
+# Name of the listing cache stored inside every wallpaper directory
+CACHE_FILE = ".wallpaper_cache.json"
+# Directory listings already loaded by this process: {directory: (mtime, files)}
+_LISTINGS = {}
+# Coarsest directory mtime resolution we expect (FAT/exFAT use 2 seconds)
+MTIME_GRANULARITY_NS = 2_000_000_000
+# File extensions treated as wallpapers
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Days that use the SUNDAY_DIR wallpapers, as a bitmask of weekday() values
+# (bit 0 is Monday, bit 6 is Sunday)
+DAY_OFF_MASK = 1 << 6
+# Monitor identifiers, replace with your own (see `xrandr` or `swaymsg -t get_outputs`)
+LEFT_MONITOR = "DP-1"
+PRIMARY_MONITOR = "DP-2"
+# xwallpaper is preferred over feh on X11 when it is installed
+XWALLPAPER = shutil.which("xwallpaper")
+# Characters sway's `output bg` would interpret: it expands the path with
+# wordexp() and splits commands on ; and , before that. Whitespace other
+# than a plain space is included, since wordexp() splits the path on it
+SWAY_SPECIAL_CHARS = frozenset("\\\"'`$&|;,<>(){}[]*?~#\t\n\r\v\f")
+# Environment values used by the script, read once at startup
+_ENV = types.SimpleNamespace(
+    session=os.environ.get("XDG_SESSION_TYPE", "unknown").lower(),
+    runtime_dir=os.environ.get("XDG_RUNTIME_DIR"),
+    swaysock=os.environ.get("SWAYSOCK"),
+)
+
+def _load_cached_listing(directory):
+    """ Returns the file names in a directory, cached until its mtime changes."""
+    mtime = os.stat(directory).st_mtime_ns
+    # In daemon mode the listing from the previous change is usually still valid
+    listing = _LISTINGS.get(directory)
+    if listing is not None and listing[0] == mtime:
+        return listing[1]
+
+    cache_path = os.path.join(directory, CACHE_FILE)
+    try:
+        with open(cache_path, encoding="utf-8") as cache:
+            cached = json.load(cache)
+        files = cached["files"]
+        # A listing made with other extensions (or a damaged cache) is a miss
+        if (cached["mtime"] == mtime
+                and cached.get("extensions") == list(IMAGE_EXTENSIONS)
+                and isinstance(files, list)
+                and all(isinstance(name, str) for name in files)):
+            _LISTINGS[directory] = (mtime, files)
+            return files
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    # Create the cache file before reading the mtime, otherwise creating it
+    # would change the mtime and invalidate the listing on the next run.
+    try:
+        cache = open(cache_path, "w", encoding="utf-8")
+    except OSError:
+        cache = None
+    mtime = os.stat(directory).st_mtime_ns
+    # DirEntry.is_file() uses the file type from readdir, so only symlinks
+    # need an extra stat call
+    with os.scandir(directory) as entries:
+        files = [entry.name for entry in entries
+                 if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file()]
+    # A change within the same mtime tick as the scan would not change the
+    # mtime (git's "racily clean" case), so don't keep such a listing. The
+    # cache file is left empty rather than removed, which would bump the mtime
+    if time.time_ns() - mtime < MTIME_GRANULARITY_NS:
+        if cache is not None:
+            cache.close()
+        return files
+    if cache is not None:
+        with cache:
+            json.dump({"mtime": mtime, "extensions": IMAGE_EXTENSIONS, "files": files},
+                      cache, separators=(",", ":"))
+    _LISTINGS[directory] = (mtime, files)
+    return files
 
 def get_random_image(directory, used_images):
     """ Returns a random image from a directory."""
-    # Get all the files in the directory - not in used images list
-# TODO: check if this works on X11
-#    files = [file for file in os.listdir(directory) if file.lower().endswith(
-#        ('.jpg', '.jpeg', '.png')) and file not in used_images]
-    images = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))
-                and f not in used_images]
+    # Get all the images in the directory - not in used images list
+    images = _load_cached_listing(directory)
+    # Nothing to exclude for the first pick, so skip rebuilding the list
+    if used_images:
+        used = set(used_images)
+        images = [f for f in images if f not in used]
 
     # If there is no image in the directory, return None
     if not images:
@@ -27,14 +109,124 @@ def get_random_image(directory, used_images):
     # Return the path of the image
     return random_img_path, used_images
 
+def _spawn_detached(args):
+    """ Starts a command in its own session and returns its pid."""
+    executable = shutil.which(args[0])
+    if executable is None:
+        raise FileNotFoundError(f"{args[0]} is not installed")
+    # posix_spawn uses vfork/clone, so our page tables are not copied.
+    # Python ignores SIGPIPE and SIGXFSZ; reset them like subprocess does
+    return os.posix_spawn(executable, args, os.environ, setsid=True,
+                          setsigdef=(signal.SIGPIPE, signal.SIGXFSZ))
+
+def _swaybg_pidfile():
+    """ Returns the file holding the pids of the swaybg started by the last run."""
+    if _ENV.runtime_dir:
+        return os.path.join(_ENV.runtime_dir, "wallpaperchanger-swaybg.pids")
+    # /tmp is shared by all users, so the fallback name includes the uid
+    return f"/tmp/wallpaperchanger-{os.getuid()}-swaybg.pids"
+
+def _read_swaybg_pids():
+    """ Returns the pids of the swaybg recorded in the pidfile."""
+    try:
+        with open(_swaybg_pidfile(), encoding="utf-8") as pidfile:
+            return [int(line) for line in pidfile if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+def _stop_swaybg(pids):
+    """ Stops the given swaybg processes."""
+    for pid in pids:
+        try:
+            try:
+                # An unreaped child of ours keeps its pid (and may not have
+                # exec'd swaybg yet), so it can be stopped right away
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    # It had already exited and is now reaped
+                    continue
+            except ChildProcessError:
+                # Other pids get reused, so only signal them if still swaybg
+                with open(f"/proc/{pid}/comm", encoding="utf-8") as comm:
+                    if comm.read().strip() != "swaybg":
+                        continue
+            os.kill(pid, signal.SIGTERM)
+            # In daemon mode swaybg is our child: reap it if it exits promptly,
+            # otherwise _reap_children() picks it up on the next change
+            for _ in range(20):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    break
+                time.sleep(0.05)
+        except OSError:
+            # Already gone, or started by an earlier process
+            pass
+
+def _stop_previous_swaybg():
+    """ Stops the swaybg processes recorded in the pidfile."""
+    _stop_swaybg(_read_swaybg_pids())
+    # The pids are handled; a reused pid must not match sway's own swaybg later
+    try:
+        os.remove(_swaybg_pidfile())
+    except OSError:
+        pass
+
+def _reap_children():
+    """ Reaps exited children, e.g. a swaybg that crashed, without blocking."""
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        # No children left
+        pass
+
+def swaybg_args(wallpapers):
+    """ Returns a single swaybg command for (monitor, image path) pairs."""
+    # swaybg applies -i/-m to the preceding -o, so every monitor gets its
+    # own triple; swaybg decodes an image used on several outputs only once
+    args = ["swaybg"]
+    for monitor, image_path in wallpapers:
+        # Fail here rather than with a TypeError inside posix_spawn
+        if image_path is None:
+            raise ValueError(f"no image to set on {monitor}")
+        args += ["-o", monitor, "-i", image_path, "-m", "fill"]
+    return args
+
+def start_swaybg(args):
+    """ Replaces the swaybg started by the previous run with a new one."""
+    old_pids = _read_swaybg_pids()
+    # Open the pidfile first so a failure cannot leave an untracked swaybg
+    with open(_swaybg_pidfile(), "w", encoding="utf-8") as pidfile:
+        try:
+            pid = _spawn_detached(args)
+        except OSError:
+            # The old swaybg still shows the wallpaper, so keep tracking it
+            pidfile.writelines(f"{old_pid}\n" for old_pid in old_pids)
+            raise
+        pidfile.write(f"{pid}\n")
+    # Stop the old swaybg only once the new one runs, so the outputs don't
+    # go blank in between
+    _stop_swaybg([old_pid for old_pid in old_pids if old_pid != pid])
+
+def sway_can_set(wallpapers):
+    """ Returns True if sway can take every image path without mangling it."""
+    return all(isinstance(image_path, str) and SWAY_SPECIAL_CHARS.isdisjoint(image_path)
+               for _, image_path in wallpapers)
+
+def set_sway_backgrounds(wallpapers):
+    """ Sets (monitor, image path) pairs as backgrounds with one swaymsg call."""
+    # Paths are checked with sway_can_set() first, so plain quoting is enough
+    commands = [f'output {monitor} bg "{image_path}" fill'
+                for monitor, image_path in wallpapers]
+    subprocess.run(args=["swaymsg", "--", "; ".join(commands)], check=True)
+
 def check_display_server():
     """ Returns the display server """
-    return os.environ.get('XDG_SESSION_TYPE', 'unknown')
+    return _ENV.session
 
-def main():
-    """Main function."""    
+def change_wallpaper():
+    """Sets the wallpaper according to the day of the week."""
     # Count days
-    current_day = datetime.datetime.today().weekday()
+    current_day = time.localtime().tm_wday
+    day_off = DAY_OFF_MASK >> current_day & 1
     # Set the directory path for wallpapers. (Constants)
     LEFT_DIR = ("/home/developer/Pictures/Wallpapers/Programmers/left_output/")
     PRIMARY_DIR = ("/home/developer/Pictures/Wallpapers/Programmers/primary_output/")
@@ -43,53 +235,79 @@ def main():
     # List to store used images
     used_images = []
 
-    # Get random image from the directory
-    left_image_path, used_images = get_random_image(LEFT_DIR, used_images)
-    primary_image_path, used_images = get_random_image(PRIMARY_DIR, used_images)
-    sunday_image_path, used_images = get_random_image(SUNDAY_DIR, used_images)
+    # Get random image only from the directories used today
+    if day_off:
+        sunday_image_path, used_images = get_random_image(SUNDAY_DIR, used_images)
+        picked = [(SUNDAY_DIR, sunday_image_path)]
+    else:
+        left_image_path, used_images = get_random_image(LEFT_DIR, used_images)
+        primary_image_path, used_images = get_random_image(PRIMARY_DIR, used_images)
+        picked = [(LEFT_DIR, left_image_path), (PRIMARY_DIR, primary_image_path)]
+
+    # Keep the current wallpaper (and swaybg) if a directory had nothing to pick
+    empty_dirs = [directory for directory, image_path in picked if image_path is None]
+    if empty_dirs:
+        print(f"No images left to pick in {', '.join(empty_dirs)}", file=sys.stderr)
+        return
 
     # get the display server
     display_server = check_display_server()
     print(display_server)
 
-    # Use swaybg if the display server is Wayland otherwise use feh
+    # Use sway IPC or swaybg if the display server is Wayland otherwise use feh
     if display_server == 'wayland':
         # Set the wallpaper according to the day
-        if current_day == 6:
-            # set all monitor SUNDAY_DIR but every monitor different wallpaper
+        if day_off:
+            # set the same SUNDAY_DIR wallpaper on all monitors
+            wallpapers = [("*", sunday_image_path)]
+        else:
+            # use random wallpaper for left and primary monitor.
+            wallpapers = [
+                (LEFT_MONITOR, left_image_path),
+                (PRIMARY_MONITOR, primary_image_path),
+            ]
+        # sway restarts its own swaybg, so just send it the new backgrounds
+        # unless a path would be mangled by sway's shell-style expansion
+        if _ENV.swaysock and sway_can_set(wallpapers):
+            # Don't leave a swaybg from an earlier run under sway's own one
+            _stop_previous_swaybg()
+            set_sway_backgrounds(wallpapers)
+        else:
+            start_swaybg(swaybg_args(wallpapers))
+
+    # If the display server is not Wayland, use xwallpaper when it is installed
+    elif XWALLPAPER:
+        # Set the wallpaper according to the day
+        if day_off:
+            # set the same SUNDAY_DIR wallpaper on all monitors
             subprocess.run(args=[
-                "swaybg",
-                "-i",
-                f"{sunday_image_path}",
-                "-m",
-                "fill"
+                XWALLPAPER,
+                "--zoom",
+                f"{sunday_image_path}"
             ], check=True)
         else:
-            # Set swaybg command but use random function to use
-            # random wallpaper for left and primary monitor.
+            # Set xwallpaper command but use random function to use
+            # random wallpaper for left and primary monitor
             subprocess.run(args=[
-                "swaybg",
-                "-i",
+                XWALLPAPER,
+                "--output",
+                LEFT_MONITOR,
+                "--zoom",
                 f"{left_image_path}",
-                "-m",
-                "fill",
-                "-o",
-                "DP-1",  # replace with your left monitor's identifier
-                "-i",
+                "--output",
+                PRIMARY_MONITOR,
+                "--zoom",
                 f"{primary_image_path}",
-                "-m",
-                "fill",
-                "-o",
-                "DP-2"  # replace with your primary monitor's identifier
             ], check=True)
 
-    # If the display server is not Wayland, use feh
+    # Otherwise fall back to feh; --no-fehbg skips writing ~/.fehbg every run
     else:
         # Set the wallpaper according to the day
-        if current_day == 6:
+        if day_off:
             # set all monitor SUNDAY_DIR but every monitor different wallpaper
             subprocess.run(args=[
                 "feh",
+                "--no-fehbg",
                 "--bg-fill",
                 f"{SUNDAY_DIR}"
             ], check=True)
@@ -102,12 +320,49 @@ def main():
             # random wallpaper for left and primary monitor
             subprocess.run(args=[
                 "feh",
+                "--no-fehbg",
                 "--bg-fill",
                 f"{left_image_path}",
                 "--bg-fill",
                 f"{primary_image_path}",
             ], check=True)
 
+def _positive_minutes(value):
+    """ Parses the --interval argument, which must be above zero."""
+    try:
+        minutes = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {value}") from None
+    # Also rejects nan and inf, which time.sleep() cannot handle
+    if not 0 < minutes < float("inf"):
+        raise argparse.ArgumentTypeError(f"must be a number greater than 0, got {value}")
+    return minutes
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and change the wallpaper every --interval minutes")
+    parser.add_argument("--interval", type=_positive_minutes, default=30,
+                        help="minutes between wallpaper changes in daemon mode (default: 30)")
+    args = parser.parse_args()
+
+    if not args.daemon:
+        change_wallpaper()
+        return
+
+    # Stay alive so the interpreter startup and imports are paid only once
+    while True:
+        # swaybg is our child here, so don't leave exited ones as zombies
+        _reap_children()
+        try:
+            change_wallpaper()
+        except (subprocess.CalledProcessError, OSError) as error:
+            # e.g. feh failing or a wallpaper directory briefly unmounted;
+            # try again on the next change instead of exiting
+            print(f"Failed to change the wallpaper: {error}", file=sys.stderr)
+        time.sleep(args.interval * 60)
+
 if __name__ == "__main__":
     main()
     
\ No newline at end of file